@@ -6,20 +6,35 @@
 # - 管理頁：/holdings /dividends /dca /trades
 # - 登入 / 註冊 / 登出
 
+import gzip
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import numpy as np
 import yfinance as yf
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from flask import (
     Flask,
-    render_template_string,
+    render_template,
+    stream_template,
     request,
     redirect,
     url_for,
     session,
     flash,
+    g,
+    has_app_context,
+    Response,
 )
+import queue
 import sqlite3
 from pathlib import Path
-from functools import wraps
+from functools import lru_cache, wraps
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # ======== 全域設定：買房目標與定投金額 =========
@@ -36,19 +51,147 @@ DEFAULT_PRICES = {
     "00919": 24.0,
 }
 
+# 股價快取秒數：同一檔 ETF 在這段時間內不重抓 Yahoo
+# （快取也寫進 DB 的 price_cache 表，重開程式或換 worker 都還在）
+PRICE_CACHE_TTL = 300
+
+# 背景更新股價的間隔秒數（設了 PRICE_REFRESH 才會啟動，見 README）
+# 比快取秒數短，快取在過期前就會被換新，首頁不必等 Yahoo
+PRICE_REFRESH_INTERVAL = PRICE_CACHE_TTL // 2
+
+# 呼叫 Yahoo 的逾時秒數：Yahoo 卡住時盡快改用預設價格，不要拖住整個 request
+YF_TIMEOUT = 3
+
+# 同一檔連續抓失敗 YF_FAIL_LIMIT 次，就 YF_COOLDOWN 秒內不再打 Yahoo（被限流時不要每次都等逾時）
+YF_FAIL_LIMIT = 3
+YF_COOLDOWN = 300
+
+# 批次下載漏掉、要逐檔補抓時，最多同時發幾個 yfinance 請求
+YF_MAX_WORKERS = 8
+
+# 回應超過這個大小（bytes）且瀏覽器支援時，用 gzip 壓縮後再送出
+GZIP_MIN_SIZE = 500
+
+# static 檔案（CSS）讓瀏覽器快取的秒數；網址帶內容雜湊，檔案改了網址就跟著變
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# 儀表板計算結果快取秒數：連續重新整理時直接用上一次的結果
+DASHBOARD_CACHE_TTL = 60
+
 # ======== SQLite 資料庫設定 =========
 # 用新的 DB 檔，避免舊的 portfolio_full.db schema 衝突
 DB_PATH = Path(__file__).with_name("portfolio_multi.db")
 
+# schema 版本（存在 DB 的 PRAGMA user_version）：改了下面 init_db 的表或索引就要加一
+SCHEMA_VERSION = 4
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# 連線池大小：連線用完放回池子重用，不用每次都重新開檔、重設 PRAGMA
+# （跟 README 裡 gunicorn 的 --threads 一樣多，每個執行緒都借得到）
+DB_POOL_SIZE = 8
+
+_db_pool = None
+_db_pool_pid = None
+
+
+def _get_pool():
+    # fork 出來的子行程不能沿用父行程的連線，換了 pid 就開一個新的池子
+    global _db_pool, _db_pool_pid
+    if _db_pool_pid != os.getpid():
+        _db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+        _db_pool_pid = os.getpid()
+    return _db_pool
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-8000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
 
+def _borrow_db():
+    try:
+        return _get_pool().get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _return_db(conn):
+    # 沒 commit 的變更先 rollback，池子滿了才真的關掉
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _get_pool().put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def close_pool():
+    """
+    把這個行程池子裡閒置的連線全部關掉（註冊成 fork 前的 hook）。
+    SQLite 的連線不能跨 fork 沿用，留給 worker 去回收會關到 master 開的檔案。
+    """
+    pool = _get_pool()
+    while True:
+        try:
+            pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+def get_db():
+    """
+    取得 DB 連線，用完要呼叫 release_db()。
+    在 request 裡整個 request 共用同一條（放在 g，request 結束才還回連線池）；
+    request 外（啟動時、背景執行緒）從連線池借一條。
+    """
+    if has_app_context():
+        if "_db" not in g:
+            g._db = _borrow_db()
+        return g._db
+    return _borrow_db()
+
+
+def iter_rows(sql, params=()):
+    """
+    邊讀邊產生查詢結果，給串流輸出（stream_template）用。
+    串流輸出時 request 的 teardown 已經跑過、共用連線已還回池子，所以另外借一條，讀完再還。
+    """
+    conn = _borrow_db()
+    try:
+        yield from conn.execute(sql, params)
+    finally:
+        _return_db(conn)
+
+
+def release_db(conn):
+    """request 外借的連線還回連線池；request 共用的那條留到 close_db() 再還。"""
+    if has_app_context() and g.get("_db") is conn:
+        return
+    _return_db(conn)
+
+
+def close_db(exc=None):
+    """request 結束時（teardown_appcontext）把這個 request 用的連線還回連線池。"""
+    conn = g.pop("_db", None)
+    if conn is not None:
+        _return_db(conn)
+
+
 def init_db():
-    conn = get_db()
+    # import 時執行（gunicorn --preload 時在 fork 前），不放進連線池，用完直接關
+    conn = _connect()
+
+    # schema 已經是最新版就不用再跑一次 DDL（不必每次開機都拿寫入鎖）
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return
+
+    conn.execute("BEGIN")
 
     # 使用者帳號
     conn.execute(
@@ -121,6 +264,58 @@ def init_db():
         """
     )
 
+    # 股價快取：key 是 "live:0050" 或 "preclose:00919:2025-09-16"，ts 是抓到的時間
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_cache (
+            key TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            ts REAL NOT NULL
+        )
+        """
+    )
+
+    # 每個使用者資料的版本號：寫入時在同一個交易裡加一。
+    # 各 worker 的快取都拿它來比對，別的 worker 改了資料，這邊的快取馬上就不算數
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """
+    )
+
+    # 交易索引：/trades 依 symbol、年份篩選並照 ts 排序，都能直接走索引
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_trades_user_symbol_ts "
+        "ON trades(user_id, symbol, ts)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_trades_user_ts ON trades(user_id, ts)"
+    )
+
+    # 配息索引：get_last_dividend_events 照 (symbol, date) 順著索引讀，不用另外排序
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_dividends_user_symbol_date "
+        "ON dividends(user_id, symbol, date)"
+    )
+    # 配息列表照日期新到舊排；id 是 rowid，本來就在索引裡，ORDER BY date, id 不用另外排序
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_dividends_user_date ON dividends(user_id, date)"
+    )
+
+    # 持股索引：get_all_holdings 的 WHERE user_id ORDER BY symbol 不必掃整張表再排序
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_holdings_user_symbol ON holdings(user_id, symbol)"
+    )
+
+    # DCA 加總索引：get_dca_total 的 SUM(amount) 直接從索引讀，不必掃整張表
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_dca_user_date ON dca(user_id, date, amount)"
+    )
+
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
@@ -138,33 +333,297 @@ def login_required(f):
 
 
 # ======== 工具：格式化 =========
+# 金額大多重複出現（同樣的投入金額、小計），格式化結果用 lru_cache 記起來
 
+@lru_cache(maxsize=4096)
 def fmt_money(x):
     return f"{x:,.0f}"
 
 
+@lru_cache(maxsize=4096)
 def fmt_pct(x):
     return f"{x:,.2f}%"
 
 
+# (秒, 該秒的時間字串)，整個 tuple 一起換掉，多執行緒下不會讀到對不上的兩半
+_now_ts_cache = (0, "")
+
+
+def now_ts():
+    """目前時間字串（YYYY-MM-DD HH:MM:SS），同一秒內重複用同一個字串。"""
+    global _now_ts_cache
+    sec = int(time.time())
+    cached = _now_ts_cache
+    if cached[0] != sec:
+        cached = _now_ts_cache = (sec, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec)))
+    return cached[1]
+
+
+# 表單數字欄位的格式（跟 <input type="number"> 送出來的一樣，可帶正負號、小數、指數）
+_INT_RE = re.compile(r"[+-]?\d+")
+_FLOAT_RE = re.compile(r"[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?")
+
+# /trades 的年份篩選：只認 4 個 ASCII 數字（str.isdigit 會放過 '²' 這類字元，int() 轉不動）
+_YEAR_RE = re.compile(r"[0-9]{4}")
+
+
+def parse_int(raw):
+    """表單整數欄位：格式對就轉成 int，空白或格式不對回傳 0。"""
+    return int(raw) if _INT_RE.fullmatch(raw) else 0
+
+
+def parse_float(raw):
+    """表單金額欄位：格式對就轉成 float，空白或格式不對回傳 0.0。"""
+    return float(raw) if _FLOAT_RE.fullmatch(raw) else 0.0
+
+
+def squeeze_html(html):
+    """去掉模板每行開頭的縮排和空白行（模板裡沒有 <pre> / <textarea>，不影響顯示）。"""
+    return re.sub(r"\n\s+", "\n", html).strip()
+
+
 # ======== yfinance 抓股價 =========
 
+# {symbol: (抓到的時間, 價格)}，只存真的從 Yahoo 抓到的價格
+_price_cache = {}
+
+
+def _load_price_cache(key):
+    """從 DB 的 price_cache 讀一筆，回傳 (抓到的時間, 價格)，沒有就回傳 None。"""
+    conn = get_db()
+    row = conn.execute(
+        "SELECT ts, price FROM price_cache WHERE key = ?", (key,)
+    ).fetchone()
+    release_db(conn)
+    return (row["ts"], row["price"]) if row else None
+
+
+def _save_price_cache(items):
+    """把 {key: price} 寫進 DB 的 price_cache（一次 commit）。"""
+    now = time.time()
+    conn = get_db()
+    conn.executemany(
+        "INSERT OR REPLACE INTO price_cache (key, price, ts) VALUES (?, ?, ?)",
+        [(key, price, now) for key, price in items.items()],
+    )
+    conn.commit()
+    release_db(conn)
+
+
+def _remember_prices(prices):
+    """抓到的即時價格同時放進記憶體和 DB 快取，並清掉失敗次數。"""
+    now = time.time()
+    for symbol, price in prices.items():
+        _price_cache[symbol] = (now, price)
+        _fail_counts.pop(symbol, None)
+    _save_price_cache({f"live:{s}": p for s, p in prices.items()})
+
+
+def _cached_price(symbol):
+    cached = _price_cache.get(symbol)
+    if not cached or time.time() - cached[0] >= PRICE_CACHE_TTL:
+        # 記憶體沒有或過期，看看 DB 裡有沒有別的 worker 剛抓的
+        cached = _load_price_cache(f"live:{symbol}")
+        if cached:
+            _price_cache[symbol] = cached
+    if cached and time.time() - cached[0] < PRICE_CACHE_TTL:
+        return cached[1]
+    return None
+
+
+# {symbol: 連續抓失敗的次數}、{symbol: 冷卻到什麼時候（time.time()）}
+_fail_counts = defaultdict(int)
+_cooldown_until = {}
+
+
+def _in_cooldown(symbol):
+    return time.time() < _cooldown_until.get(symbol, 0)
+
+
+def _record_failure(symbol):
+    _fail_counts[symbol] += 1
+    if _fail_counts[symbol] >= YF_FAIL_LIMIT:
+        _cooldown_until[symbol] = time.time() + YF_COOLDOWN
+        _fail_counts[symbol] = 0
+
+
+def _fallback_price(symbol):
+    """抓不到價格時：先用最後一次抓到的（就算已過期），從沒抓到過才用 DEFAULT_PRICES。"""
+    cached = _price_cache.get(symbol)
+    if cached:
+        return cached[1]
+    print(f"[改用預設價格] {symbol} = {DEFAULT_PRICES.get(symbol, 0.0)}")
+    return DEFAULT_PRICES.get(symbol, 0.0)
+
+# {symbol: yf.Ticker}，同一檔重複用同一個 Ticker 物件
+_tickers = {}
+
+
+def get_ticker(symbol):
+    """回傳 symbol 對應的 yf.Ticker（台股加 .TW），第一次用到才建立。"""
+    ticker = _tickers.get(symbol)
+    if ticker is None:
+        ticker = _tickers[symbol] = yf.Ticker(symbol + ".TW")
+    return ticker
+
+
 def fetch_price_tw(symbol):
-    """用 yfinance 抓台股 ETF 價格，失敗就用 DEFAULT_PRICES。"""
-    ticker_symbol = symbol + ".TW"
+    """用 yfinance 抓台股 ETF 價格（PRICE_CACHE_TTL 秒內用快取），失敗就用 _fallback_price。"""
+    cached = _cached_price(symbol)
+    if cached is not None:
+        return cached
+    if _in_cooldown(symbol):
+        return _fallback_price(symbol)
+
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        data = ticker.history(period="5d")
+        ticker = get_ticker(symbol)
+        data = ticker.history(period="5d", timeout=YF_TIMEOUT)
 
         if not data.empty:
             close_series = data["Close"].dropna()
             if not close_series.empty:
-                return float(close_series.iloc[-1])
+                price = float(close_series.iloc[-1])
+                _remember_prices({symbol: price})
+                return price
     except Exception as e:
         print(f"[警告] 抓 {symbol} 價格失敗：{e}")
 
-    print(f"[改用預設價格] {symbol} = {DEFAULT_PRICES.get(symbol, 0.0)}")
-    return DEFAULT_PRICES.get(symbol, 0.0)
+    _record_failure(symbol)
+    return _fallback_price(symbol)
+
+
+def _ticker_frame(data, ticker_symbol, n_tickers):
+    """從 yf.download(group_by="ticker") 的結果取出單一檔的欄位，沒有就回傳 None。"""
+    if ticker_symbol in data.columns.get_level_values(0):
+        return data[ticker_symbol]
+    if n_tickers == 1:
+        return data  # 舊版 yfinance 單檔下載不分 ticker 欄位
+    return None
+
+
+def _download_closes_tw(symbols):
+    """用一次 yf.download 抓多檔的最後收盤價，回傳 {symbol: price}（抓不到的不放）。"""
+    tickers = [s + ".TW" for s in symbols]
+    try:
+        data = yf.download(
+            " ".join(tickers),
+            period="5d",
+            group_by="ticker",
+            progress=False,
+            threads=True,
+            timeout=YF_TIMEOUT,
+        )
+    except Exception as e:
+        print(f"[警告] 批次抓價格失敗：{e}")
+        return {}
+
+    if data is None or data.empty:
+        return {}
+
+    prices = {}
+    for symbol, ticker_symbol in zip(symbols, tickers):
+        frame = _ticker_frame(data, ticker_symbol, len(tickers))
+        if frame is None:
+            continue
+
+        close_series = frame["Close"].dropna()
+        if not close_series.empty:
+            prices[symbol] = float(close_series.iloc[-1])
+
+    return prices
+
+
+def fetch_prices_tw(symbols):
+    """
+    一次抓多檔 ETF 價格，回傳 {symbol: price}。
+    沒有快取的先用一次 yf.download 批次抓；批次裡缺的再各自抓（同時發出），
+    最後仍抓不到的由 fetch_price_tw 退回 _fallback_price；冷卻中的直接用 _fallback_price。
+    """
+    prices = {}
+    missing = []
+    for symbol in dict.fromkeys(symbols):  # 去重但保留順序
+        cached = _cached_price(symbol)
+        if cached is not None:
+            prices[symbol] = cached
+        elif _in_cooldown(symbol):
+            prices[symbol] = _fallback_price(symbol)
+        else:
+            missing.append(symbol)
+
+    if missing:
+        fetched = _download_closes_tw(missing)
+        if fetched:
+            _remember_prices(fetched)
+        prices.update(fetched)
+
+        rest = [s for s in missing if s not in fetched]
+        if rest:
+            with ThreadPoolExecutor(max_workers=min(YF_MAX_WORKERS, len(rest))) as ex:
+                prices.update(zip(rest, ex.map(fetch_price_tw, rest)))
+
+    return prices
+
+
+def prefetch_prices():
+    """
+    把所有使用者持有的 ETF 價格先抓進快取（記憶體和 DB 的 price_cache）。
+    搭配 gunicorn --preload 時，每個 worker fork 出來後在背景各跑一次（見 _prefetch_in_background）。
+    """
+    fetch_prices_tw(_held_symbols())
+
+
+def _held_symbols():
+    """所有使用者持有的 ETF 代號。"""
+    conn = get_db()  # worker 換了 pid 會重開連線池，不會沿用 master 這條
+    cur = conn.execute("SELECT DISTINCT symbol FROM holdings")
+    symbols = [r["symbol"] for r in cur.fetchall()]
+    release_db(conn)
+    return symbols
+
+
+def refresh_prices():
+    """
+    不管快取有沒有過期，重抓所有持有 ETF 的價格。
+    別的 worker 剛更新過（DB 裡的價格還很新）的就跳過，不重複打 Yahoo。
+    """
+    now = time.time()
+    symbols = []
+    for symbol in _held_symbols():
+        cached = _load_price_cache(f"live:{symbol}")
+        if cached and now - cached[0] < PRICE_REFRESH_INTERVAL:
+            _price_cache[symbol] = cached
+        elif not _in_cooldown(symbol):
+            symbols.append(symbol)
+
+    if symbols:
+        fetched = _download_closes_tw(symbols)
+        if fetched:
+            _remember_prices(fetched)
+
+
+def _price_refresher():
+    """背景執行緒：每 PRICE_REFRESH_INTERVAL 秒更新一次價格，抓失敗就等下一輪。"""
+    while True:
+        try:
+            refresh_prices()
+        except Exception as e:
+            print(f"[警告] 背景更新價格失敗：{e}")
+        time.sleep(PRICE_REFRESH_INTERVAL)
+
+
+# 已經啟動背景更新的 pid：gunicorn --preload 在 master 開的執行緒 fork 後不會跟過去，
+# 所以每個 worker 第一次收到 request 時才各自啟動
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def start_price_refresher():
+    global _refresher_pid
+    with _refresher_lock:
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+    threading.Thread(target=_price_refresher, daemon=True).start()
 
 
 # ======== DB 讀取工具（全部加 user_id） =========
@@ -176,30 +635,24 @@ def get_all_holdings(user_id):
         (user_id,),
     )
     rows = cur.fetchall()
-    conn.close()
+    release_db(conn)
     return rows
 
 
 def get_all_dividends(user_id):
-    conn = get_db()
-    cur = conn.execute(
+    """日期新到舊逐筆產生（給 stream_template 邊讀邊輸出，不先 fetchall）。"""
+    return iter_rows(
         "SELECT * FROM dividends WHERE user_id = ? ORDER BY date DESC, id DESC",
         (user_id,),
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
 def get_all_dca(user_id):
-    conn = get_db()
-    cur = conn.execute(
+    """日期新到舊逐筆產生（給 stream_template 邊讀邊輸出，不先 fetchall）。"""
+    return iter_rows(
         "SELECT * FROM dca WHERE user_id = ? ORDER BY date DESC, id DESC",
         (user_id,),
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
 def get_trades_summary(user_id):
@@ -222,26 +675,19 @@ def get_trades_summary(user_id):
         """,
         (user_id,),
     )
-    rows = cur.fetchall()
-    conn.close()
-
-    summary = {}
-    total_amount = 0.0
-    total_reinvest = 0.0
-
-    for r in rows:
-        sym = r["symbol"]
-        add_shares = r["add_shares"]
-        add_amount = r["add_amount"]
-        add_reinvest = r["add_reinvest"]
-        summary[sym] = {
-            "add_shares": add_shares,
-            "add_amount": add_amount,
-            "add_reinvest": add_reinvest,
+    # 每檔一列，直接從 cursor 建 dict，不先 fetchall 成 list
+    summary = {
+        r["symbol"]: {
+            "add_shares": r["add_shares"],
+            "add_amount": r["add_amount"],
+            "add_reinvest": r["add_reinvest"],
         }
-        total_amount += add_amount
-        total_reinvest += add_reinvest
+        for r in cur
+    }
+    release_db(conn)
 
+    total_amount = sum((v["add_amount"] for v in summary.values()), 0.0)
+    total_reinvest = sum((v["add_reinvest"] for v in summary.values()), 0.0)
     total_new_cash = max(0.0, total_amount - total_reinvest)
 
     return summary, total_amount, total_reinvest, total_new_cash
@@ -249,47 +695,84 @@ def get_trades_summary(user_id):
 
 # ======== 配息 / DCA 計算工具（加 user_id） =========
 
-def get_dividends_total(symbol, user_id):
+# {user_id: (查詢時間, 資料版本號, symbols, years)}
+_trade_filters_cache = {}
+
+
+def get_trade_filters(user_id):
+    """
+    /trades 篩選下拉選單用的 (symbols, years)，很少變動，
+    DASHBOARD_CACHE_TTL 秒內、資料版本號沒變就直接用快取（任何 worker 寫入都會讓版本號變）。
+    """
+    version = get_data_version(user_id)
+    cached = _trade_filters_cache.get(user_id)
+    if cached and cached[1] == version and time.time() - cached[0] < DASHBOARD_CACHE_TTL:
+        return cached[2], cached[3]
+
     conn = get_db()
     cur = conn.execute(
-        "SELECT COALESCE(SUM(cash),0) AS s FROM dividends WHERE symbol = ? AND user_id = ?",
-        (symbol, user_id),
+        "SELECT DISTINCT symbol FROM trades WHERE user_id = ? ORDER BY symbol",
+        (user_id,),
     )
-    row = cur.fetchone()
-    conn.close()
-    return row["s"] if row and row["s"] is not None else 0.0
+    symbols = [r["symbol"] for r in cur]
 
+    cur = conn.execute(
+        "SELECT DISTINCT substr(ts,1,4) AS y FROM trades WHERE user_id = ? ORDER BY y DESC",
+        (user_id,),
+    )
+    years = [r["y"] for r in cur if r["y"]]
+    release_db(conn)
 
-def get_dividends_total_by_year(year, user_id):
+    _trade_filters_cache[user_id] = (time.time(), version, symbols, years)
+    return symbols, years
+
+
+def get_dividend_totals(user_id):
+    """
+    一次查出配息彙總（取代每檔 / 每年各查一次），回傳：
+      by_symbol: {symbol: 配息總額}
+      by_year:   {year(int): 配息總額}
+    """
     conn = get_db()
     cur = conn.execute(
         """
-        SELECT COALESCE(SUM(cash),0) AS s
+        SELECT symbol, CAST(substr(date,1,4) AS INTEGER) AS y, COALESCE(SUM(cash),0) AS s
         FROM dividends
-        WHERE substr(date,1,4) = ? AND user_id = ?
+        WHERE user_id = ?
+        GROUP BY symbol, y
         """,
-        (str(year), user_id),
+        (user_id,),
     )
-    row = cur.fetchone()
-    conn.close()
-    return row["s"] if row and row["s"] is not None else 0.0
+    rows = cur.fetchall()
+    release_db(conn)
+
+    by_symbol = defaultdict(float)
+    by_year = defaultdict(float)
+    for r in rows:
+        by_symbol[r["symbol"]] += r["s"]
+        by_year[r["y"]] += r["s"]
 
+    return by_symbol, by_year
 
-def get_last_dividend_event(symbol, user_id):
+
+def get_last_dividend_events(user_id):
+    """
+    一次查出每檔 ETF 最近一次配息（取代每檔各查一次），回傳 {symbol: row}。
+    依日期排好後一路覆蓋，留下來的就是最後一筆。
+    """
     conn = get_db()
     cur = conn.execute(
         """
         SELECT *
         FROM dividends
-        WHERE symbol = ? AND user_id = ?
-        ORDER BY date DESC, id DESC
-        LIMIT 1
+        WHERE user_id = ?
+        ORDER BY symbol, date, id
         """,
-        (symbol, user_id),
+        (user_id,),
     )
-    row = cur.fetchone()
-    conn.close()
-    return row
+    last_events = {r["symbol"]: r for r in cur}
+    release_db(conn)
+    return last_events
 
 
 def get_dca_total(user_id, year=None):
@@ -304,63 +787,184 @@ def get_dca_total(user_id, year=None):
             """
             SELECT COALESCE(SUM(amount),0) AS s
             FROM dca
-            WHERE user_id = ? AND substr(date,1,4) = ?
+            WHERE user_id = ? AND date >= ? AND date < ?
             """,
-            (user_id, str(year)),
+            # 用日期範圍比對（'2025' <= date < '2026'），才能走 idx_dca_user_date
+            (user_id, str(year), str(int(year) + 1)),
         )
     row = cur.fetchone()
-    conn.close()
+    release_db(conn)
     return row["s"] if row and row["s"] is not None else 0.0
 
 
 # ======== 填息計算 =========
 
+# {"preclose:symbol:ex_date": 價格}，已經確定不會再變的除息前收盤價，放在記憶體裡不必再查 DB
+_pre_close_cache = {}
+
+
+def _cached_pre_close(symbol, ex_date_str):
+    """先看記憶體、再看 DB 的 price_cache，都沒有回傳 None。"""
+    key = f"preclose:{symbol}:{ex_date_str}"
+    price = _pre_close_cache.get(key)
+    if price is None:
+        cached = _load_price_cache(key)
+        if cached:
+            price = _pre_close_cache[key] = cached[1]
+    return price
+
+
+def _remember_pre_closes(prices):
+    """
+    把 {(symbol, ex_date_str): price} 存進記憶體和 DB 快取。
+    只存已經過去的除息日；還沒到的那天收盤價可能還會變。
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    items = {
+        f"preclose:{s}:{d}": price
+        for (s, d), price in prices.items()
+        if d <= today
+    }
+    if items:
+        _pre_close_cache.update(items)
+        _save_price_cache(items)
+
+
 def get_pre_ex_close_price(symbol, ex_date_str):
     """
     給 symbol（例如 '00919'）和配息日期（例如 '2025-09-16'），
     回傳「除息日前一個交易日」的收盤價。
+    已經過去的除息日，這個價格不會再變，抓到一次就快取起來一直用。
     """
-    ex_date = datetime.strptime(ex_date_str, "%Y-%m-%d").date()
-    ticker = yf.Ticker(symbol + ".TW")
+    cached = _cached_pre_close(symbol, ex_date_str)
+    if cached is not None:
+        return cached
+
+    ex_date = date.fromisoformat(ex_date_str)  # 表單是 type="date"，一定是 YYYY-MM-DD
+    ticker = get_ticker(symbol)
 
     # 抓 ex_date 往前 20 天，避免遇到連假沒交易
     start = ex_date - timedelta(days=20)
     end = ex_date  # history 的 end 不含當天
-    data = ticker.history(start=start, end=end)
+    data = ticker.history(start=start, end=end, timeout=YF_TIMEOUT)
 
     if data.empty:
         return None
 
     pre_close = float(data["Close"].iloc[-1])
+    _remember_pre_closes({(symbol, ex_date_str): pre_close})
     return pre_close
 
 
+def _download_pre_closes_tw(pairs):
+    """
+    用一次 yf.download 抓多組 (symbol, ex_date_str) 的除息前收盤價，
+    回傳 {(symbol, ex_date_str): price}（抓不到的不放）。
+    """
+    ex_dates = {p: date.fromisoformat(p[1]) for p in pairs}
+    tickers = list(dict.fromkeys(s + ".TW" for s, _ in pairs))
+
+    # 區間涵蓋所有除息日，每組再各自切出「除息日往前 20 天」那段
+    start = min(ex_dates.values()) - timedelta(days=20)
+    end = max(ex_dates.values())  # download 的 end 不含當天
+    try:
+        data = yf.download(
+            " ".join(tickers),
+            start=start,
+            end=end,
+            group_by="ticker",
+            progress=False,
+            threads=True,
+            timeout=YF_TIMEOUT,
+        )
+    except Exception as e:
+        print(f"[警告] 批次抓除息前收盤價失敗：{e}")
+        return {}
+
+    if data is None or data.empty:
+        return {}
+
+    prices = {}
+    for (symbol, ex_date_str), ex_date in ex_dates.items():
+        frame = _ticker_frame(data, symbol + ".TW", len(tickers))
+        if frame is None:
+            continue
+
+        close_series = frame["Close"].dropna()
+        days = close_series.index.date
+        close_series = close_series[
+            (days >= ex_date - timedelta(days=20)) & (days < ex_date)
+        ]
+        if not close_series.empty:
+            prices[(symbol, ex_date_str)] = float(close_series.iloc[-1])
+
+    return prices
+
+
+def get_pre_ex_close_prices(pairs):
+    """
+    一次查多組 (symbol, ex_date_str) 的除息前收盤價，回傳 {(symbol, ex_date_str): price 或 None}。
+    快取沒有的先用一次 yf.download 批次抓；批次裡缺的再各自用 get_pre_ex_close_price 抓（同時發出）。
+    """
+    result = {}
+    missing = []
+    for symbol, ex_date_str in dict.fromkeys(pairs):
+        cached = _cached_pre_close(symbol, ex_date_str)
+        if cached is not None:
+            result[(symbol, ex_date_str)] = cached
+        else:
+            missing.append((symbol, ex_date_str))
+
+    if missing:
+        fetched = _download_pre_closes_tw(missing)
+        _remember_pre_closes(fetched)
+        result.update(fetched)
+
+        rest = [p for p in missing if p not in fetched]
+        if rest:
+            with ThreadPoolExecutor(max_workers=min(YF_MAX_WORKERS, len(rest))) as ex:
+                result.update(zip(rest, ex.map(lambda p: get_pre_ex_close_price(*p), rest)))
+
+    return result
+
+
 def compute_fill_infos(etf_rows, user_id):
     """
     傳入 compute_dashboard() 產出的 etfs list，
     回傳每檔 ETF 的填息資訊（最近一次配息）。
     """
-    fill_infos = []
+    last_events = get_last_dividend_events(user_id)
 
+    candidates = []
     for e in etf_rows:
+        last_ev = last_events.get(e["symbol"])
+        if not last_ev:
+            continue
+        if not e["shares"] or e["shares"] <= 0:
+            continue
+        candidates.append((e, last_ev))
+
+    if not candidates:
+        return []
+
+    pre_closes = get_pre_ex_close_prices(
+        [(e["symbol"], ev["date"]) for e, ev in candidates]
+    )
+
+    fill_infos = []
+
+    for e, last_ev in candidates:
+        pre_close = pre_closes[(e["symbol"], last_ev["date"])]
         symbol = e["symbol"]
         shares = e["shares"]
         now_price = e["price"]
         name = e["name"]
 
-        last_ev = get_last_dividend_event(symbol, user_id)
-        if not last_ev:
-            continue
-
         last_date = last_ev["date"]
         cash_total = last_ev["cash"]
 
-        if not shares or shares <= 0:
-            continue
-
         div_per_share = cash_total / shares
 
-        pre_close = get_pre_ex_close_price(symbol, last_date)
         if pre_close is None:
             continue
 
@@ -383,6 +987,12 @@ def compute_fill_infos(etf_rows, user_id):
             "div_per_share": div_per_share,
             "fill_ratio": fill_ratio,
             "gap_to_fill": gap_to_fill,
+            # 模板直接輸出的字串，先在這裡格式化好
+            "fill_ratio_fmt": f"{fill_ratio:.1f}",
+            "div_per_share_fmt": f"{div_per_share:.3f}",
+            "pre_close_fmt": f"{pre_close:.2f}",
+            "now_price_fmt": f"{now_price:.2f}",
+            "gap_to_fill_fmt": f"{gap_to_fill:.2f}",
         })
 
     return fill_infos
@@ -391,73 +1001,86 @@ def compute_fill_infos(etf_rows, user_id):
 # ======== 買房目標試算 =========
 
 def estimate_years_to_target(current_value, monthly_invest, annual_return, target):
+    """
+    解 current_value*(1+r)^n + 每年投入*((1+r)^n - 1)/r = target 的 n（年），
+    直接用對數求解，不再每 0.25 年模擬一次。
+    已達標回傳 0.0，80 年內達不到回傳 None。
+    """
     r = annual_return
     yearly_invest = monthly_invest * 12
-    years = 0.0
-    step = 0.25  # 每 0.25 年（約 3 個月）模擬一次
-
-    while years <= 80:
-        n = years
-        fv_lump = current_value * (1 + r) ** n
-        fv_dca = yearly_invest * ((1 + r) ** n - 1) / r
-        fv_total = fv_lump + fv_dca
-        if fv_total >= target:
-            return round(years, 1)
-        years += step
-
-    return None
 
+    if current_value >= target:
+        return 0.0
 
-# ======== 儀表板計算（加 user_id） =========
-
-def compute_dashboard(user_id):
-    holdings_rows = list(get_all_holdings(user_id))
-    etf_rows = []
-
-    total_cost = 0.0
-    total_mv = 0.0
-    total_dividends = 0.0
-
-    price_cache = {}
-
-    for h in holdings_rows:
-        symbol = h["symbol"]
-        name = h["name"]
-        shares = h["shares"]
-        cost = h["cost"]
+    if r == 0:
+        if yearly_invest <= 0:
+            return None
+        years = (target - current_value) / yearly_invest
+    else:
+        k = yearly_invest / r
+        ratio = (target + k) / (current_value + k) if current_value + k else 0.0
+        if ratio <= 0:
+            return None
+        years = math.log(ratio) / math.log(1 + r)
 
-        if symbol in price_cache:
-            price = price_cache[symbol]
-        else:
-            price = fetch_price_tw(symbol)
-            price_cache[symbol] = price
+    return round(years, 1) if 0 <= years <= 80 else None
 
-        cost_total = shares * cost
-        mv = shares * price
-        profit = mv - cost_total
-        pl_pct = (profit / cost_total * 100) if cost_total else 0.0
 
-        div_total = get_dividends_total(symbol, user_id)
-        profit_with_div = profit + div_total
-        pl_with_div_pct = (profit_with_div / cost_total * 100) if cost_total else 0.0
+# ======== 儀表板計算（加 user_id） =========
 
-        total_cost += cost_total
-        total_mv += mv
-        total_dividends += div_total
+def compute_dashboard(user_id):
+    holdings_rows = get_all_holdings(user_id)  # 已經是 fetchall() 的 list
+
+    div_by_symbol, div_by_year = get_dividend_totals(user_id)
+    symbols = [h["symbol"] for h in holdings_rows]
+    prices = fetch_prices_tw(symbols)
+
+    # 每檔的成本 / 市值 / 損益一次用陣列算完，不再逐筆做純 Python 運算
+    shares = np.array([h["shares"] for h in holdings_rows], dtype=float)
+    cost = np.array([h["cost"] for h in holdings_rows], dtype=float)
+    price = np.array([prices[s] for s in symbols], dtype=float)
+    div_total = np.array([div_by_symbol.get(s, 0.0) for s in symbols], dtype=float)
+
+    cost_total = shares * cost
+    mv = shares * price
+    profit = mv - cost_total
+    profit_with_div = profit + div_total
+    has_cost = cost_total != 0
+    safe_cost = np.where(has_cost, cost_total, 1.0)
+    pl_pct = np.where(has_cost, profit / safe_cost * 100, 0.0)
+    pl_with_div_pct = np.where(has_cost, profit_with_div / safe_cost * 100, 0.0)
+
+    etf_rows = [
+        {
+            "symbol": h["symbol"],
+            "name": h["name"],
+            "shares": h["shares"],
+            "price": row_price,
+            "cost_total": row_cost_total,
+            "mv": row_mv,
+            "profit": row_profit,
+            "pl_pct": row_pl_pct,
+            "div_total": row_div_total,
+            "profit_with_div": row_profit_with_div,
+            "pl_with_div_pct": row_pl_with_div_pct,
+            # 模板直接輸出的字串，先在這裡格式化好
+            "price_fmt": f"{row_price:.2f}",
+            "mv_fmt": fmt_money(row_mv),
+            "pl_with_div_fmt": f"{row_pl_with_div_pct:.1f}",
+        }
+        for (
+            h, row_price, row_cost_total, row_mv, row_profit, row_pl_pct,
+            row_div_total, row_profit_with_div, row_pl_with_div_pct,
+        ) in zip(
+            holdings_rows, price.tolist(), cost_total.tolist(), mv.tolist(),
+            profit.tolist(), pl_pct.tolist(), div_total.tolist(),
+            profit_with_div.tolist(), pl_with_div_pct.tolist(),
+        )
+    ]
 
-        etf_rows.append({
-            "symbol": symbol,
-            "name": name,
-            "shares": shares,
-            "price": price,
-            "cost_total": cost_total,
-            "mv": mv,
-            "profit": profit,
-            "pl_pct": pl_pct,
-            "div_total": div_total,
-            "profit_with_div": profit_with_div,
-            "pl_with_div_pct": pl_with_div_pct,
-        })
+    total_cost = float(cost_total.sum())
+    total_mv = float(mv.sum())
+    total_dividends = float(div_total.sum())
 
     total_profit = total_mv - total_cost
     total_profit_with_div = total_profit + total_dividends
@@ -466,8 +1089,8 @@ def compute_dashboard(user_id):
 
     current_year = datetime.now().year
     last_year = current_year - 1
-    div_last_year = get_dividends_total_by_year(last_year, user_id)
-    div_this_year = get_dividends_total_by_year(current_year, user_id)
+    div_last_year = div_by_year.get(last_year, 0.0)
+    div_this_year = div_by_year.get(current_year, 0.0)
     diff_div = div_this_year - div_last_year
 
     dca_total_all = get_dca_total(user_id)
@@ -489,6 +1112,8 @@ def compute_dashboard(user_id):
 
     fill_infos = compute_fill_infos(etf_rows, user_id) if etf_rows else []
 
+    _, trade_amount, trade_reinvest, trade_new_cash = get_trades_summary(user_id)
+
     return {
         "etfs": etf_rows,
         "totals": {
@@ -520,161 +1145,78 @@ def compute_dashboard(user_id):
             "years_high": years_high,
         },
         "fill_infos": fill_infos,
+        "trade_totals": {
+            "total_amount": trade_amount,
+            "total_reinvest": trade_reinvest,
+            "total_new_cash": trade_new_cash,
+        },
     }
 
 
+def get_data_version(user_id):
+    """使用者資料目前的版本號（data_versions 表，所有 worker 共用），還沒寫過資料是 0。"""
+    conn = get_db()
+    row = conn.execute(
+        "SELECT version FROM data_versions WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    release_db(conn)
+    return row["version"] if row else 0
+
+
+def bump_data_version(conn, user_id):
+    """寫入時呼叫（在 commit 之前），讓版本號跟資料變動在同一個交易裡一起生效。"""
+    conn.execute(
+        """
+        INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        """,
+        (user_id,),
+    )
+
+
+# {user_id: (計算時間, 資料版本號, compute_dashboard 結果)}
+_dashboard_cache = {}
+
+
+def get_dashboard(user_id, version):
+    """
+    DASHBOARD_CACHE_TTL 秒內重複進首頁、而且資料版本號沒變時，直接回傳上一次的結果。
+    version 要在計算前先讀（get_data_version），算到一半有人寫入也只會讓下一次重算。
+    """
+    cached = _dashboard_cache.get(user_id)
+    if cached and cached[1] == version and time.time() - cached[0] < DASHBOARD_CACHE_TTL:
+        return cached[2]
+
+    data = compute_dashboard(user_id)
+    _dashboard_cache[user_id] = (time.time(), version, data)
+    return data
+
+
+def invalidate_dashboard(user_id):
+    """
+    持股 / 配息 / DCA / 交易有變動時呼叫，先清掉這個 worker 的快取。
+    其他 worker 的快取靠 bump_data_version 的版本號判斷過期。
+    """
+    _dashboard_cache.pop(user_id, None)
+    _index_html_cache.pop(user_id, None)
+    _trade_filters_cache.pop(user_id, None)
+
+
+# {user_id: (產生時用的 get_dashboard 結果, 最後更新時間字串, 首頁 HTML 的 UTF-8 bytes, ETag)}
+# get_dashboard 重算後會是新的物件，舊 HTML 自然就對不上
+_index_html_cache = {}
+
+
 # ======== HTML 模板：首頁（儀表板，含登入資訊） =========
 
-TEMPLATE_INDEX = """
+TEMPLATE_INDEX = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>ETF & 買房儀表板</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body {
-      font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-      background: #f5f5f7;
-      margin: 0;
-      padding: 16px;
-    }
-    .container {
-      max-width: 480px;
-      margin: 0 auto 32px;
-    }
-    h1 {
-      font-size: 24px;
-      text-align: center;
-      margin-bottom: 4px;
-    }
-    .subtitle {
-      text-align: center;
-      font-size: 13px;
-      color: #666;
-      margin-bottom: 8px;
-    }
-    .nav {
-      text-align: center;
-      font-size: 12px;
-      margin-bottom: 10px;
-      line-height: 1.6;
-    }
-    .nav a {
-      color: #3949ab;
-      text-decoration: none;
-      margin: 0 4px;
-    }
-    .userbar {
-      text-align:center;
-      font-size:12px;
-      margin-bottom:6px;
-      color:#555;
-    }
-    .userbar a {
-      color:#3949ab;
-      text-decoration:none;
-      margin-left:6px;
-    }
-    .card {
-      background: #fff;
-      border-radius: 16px;
-      padding: 16px 18px;
-      margin-bottom: 14px;
-      box-shadow: 0 6px 18px rgba(0,0,0,0.06);
-    }
-    .card h2 {
-      font-size: 18px;
-      margin: 0 0 8px;
-    }
-    .row {
-      display: flex;
-      justify-content: space-between;
-      margin: 4px 0;
-      font-size: 14px;
-      align-items: center;
-      gap: 8px;
-    }
-    .label {
-      color: #555;
-    }
-    .value {
-      font-weight: 600;
-    }
-    .big-number {
-      font-size: 22px;
-      font-weight: 700;
-      margin: 8px 0;
-    }
-    .positive {
-      color: #0a8f3c;
-    }
-    .negative {
-      color: #d32f2f;
-    }
-    .neutral {
-      color: #f9a825;
-    }
-    .chip {
-      display: inline-block;
-      padding: 2px 8px;
-      border-radius: 999px;
-      font-size: 11px;
-      background: #eef2ff;
-      color: #3949ab;
-      margin-left: 4px;
-    }
-    .etf-list {
-      margin-top: 8px;
-      border-top: 1px solid #eee;
-      padding-top: 6px;
-      max-height: 260px;
-      overflow-y: auto;
-    }
-    .etf-item {
-      padding: 4px 0;
-      border-bottom: 1px dashed #eee;
-      font-size: 13px;
-    }
-    .etf-item:last-child {
-      border-bottom: none;
-    }
-    .etf-header {
-      display: flex;
-      justify-content: space-between;
-      font-weight: 600;
-      margin-bottom: 2px;
-    }
-    .etf-sub {
-      display: flex;
-      justify-content: space-between;
-      color: #666;
-    }
-    .note {
-      font-size: 11px;
-      color: #999;
-      margin-top: 6px;
-      line-height: 1.4;
-    }
-    input[type="number"], input[type="date"], select {
-      border-radius: 999px;
-      border: 1px solid #ddd;
-      padding: 4px 8px;
-      font-size: 13px;
-      flex: 1;
-    }
-    button {
-      cursor: pointer;
-    }
-    .flash {
-      background:#ffeaa7;
-      padding:6px 10px;
-      border-radius:999px;
-      font-size:12px;
-      margin-bottom:8px;
-      text-align:center;
-    }
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/index.css') }}">
 </head>
 <body>
 <div class="container">
@@ -742,9 +1284,9 @@ TEMPLATE_INDEX = """
       </div>
     {% endif %}
     <div class="note">
-      歷史累積：投入 {{ fmt_money(trade_totals.total_amount) }} 元，<br>
-      其中配息複投 {{ fmt_money(trade_totals.total_reinvest) }} 元，<br>
-      自掏腰包 {{ fmt_money(trade_totals.total_new_cash) }} 元。
+      歷史累積：投入 {{ trade_totals.total_amount|money }} 元，<br>
+      其中配息複投 {{ trade_totals.total_reinvest|money }} 元，<br>
+      自掏腰包 {{ trade_totals.total_new_cash|money }} 元。
     </div>
   </div>
 
@@ -753,24 +1295,24 @@ TEMPLATE_INDEX = """
     {% if etfs %}
       <div class="row">
         <span class="label">總成本（以持股表為準）</span>
-        <span class="value">{{ fmt_money(totals.total_cost) }} 元</span>
+        <span class="value">{{ totals.total_cost|money }} 元</span>
       </div>
       <div class="row">
         <span class="label">總市值</span>
-        <span class="value">{{ fmt_money(totals.total_mv) }} 元</span>
+        <span class="value">{{ totals.total_mv|money }} 元</span>
       </div>
       <div class="big-number {% if totals.total_profit_with_div > 0 %}positive{% elif totals.total_profit_with_div < 0 %}negative{% else %}neutral{% endif %}">
-        含息報酬率：{{ fmt_pct(totals.total_pl_with_div_pct) }}
+        含息報酬率：{{ totals.total_pl_with_div_pct|pct }}
       </div>
       <div class="row">
         <span class="label">未實現損益</span>
         <span class="value {% if totals.total_profit > 0 %}positive{% elif totals.total_profit < 0 %}negative{% else %}neutral{% endif %}">
-          {{ fmt_money(totals.total_profit) }} 元
+          {{ totals.total_profit|money }} 元
         </span>
       </div>
       <div class="row">
         <span class="label">已領配息總額</span>
-        <span class="value">{{ fmt_money(totals.total_dividends) }} 元</span>
+        <span class="value">{{ totals.total_dividends|money }} 元</span>
       </div>
 
       <div class="etf-list">
@@ -779,12 +1321,12 @@ TEMPLATE_INDEX = """
           <div class="etf-header">
             <span>{{ e.symbol }} · {{ e.name }}</span>
             <span class="{% if e.profit_with_div > 0 %}positive{% elif e.profit_with_div < 0 %}negative{% else %}neutral{% endif %}">
-              {{ '%.1f' % e.pl_with_div_pct }}%
+              {{ e.pl_with_div_fmt }}%
             </span>
           </div>
           <div class="etf-sub">
-            <span>股數 {{ e.shares }}｜現價 {{ '%.2f' % e.price }}</span>
-            <span>市值 {{ fmt_money(e.mv) }} 元</span>
+            <span>股數 {{ e.shares }}｜現價 {{ e.price_fmt }}</span>
+            <span>市值 {{ e.mv_fmt }} 元</span>
           </div>
         </div>
         {% endfor %}
@@ -798,14 +1340,14 @@ TEMPLATE_INDEX = """
     <h2>配息年度對比</h2>
     <div class="row">
       <span class="label">{{ div_compare.last_year }} 年配息總額</span>
-      <span class="value">{{ fmt_money(div_compare.div_last_year) }} 元</span>
+      <span class="value">{{ div_compare.div_last_year|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">{{ div_compare.current_year }} 年配息總額</span>
-      <span class="value">{{ fmt_money(div_compare.div_this_year) }} 元</span>
+      <span class="value">{{ div_compare.div_this_year|money }} 元</span>
     </div>
     <div class="big-number {% if div_compare.diff_div > 0 %}positive{% elif div_compare.diff_div < 0 %}negative{% else %}neutral{% endif %}">
-      {{ '今年比去年多' if div_compare.diff_div >= 0 else '今年比去年少' }}：{{ fmt_money(div_compare.diff_div) }} 元
+      {{ '今年比去年多' if div_compare.diff_div >= 0 else '今年比去年少' }}：{{ div_compare.diff_div|money }} 元
     </div>
     <div class="note">
       以「配息管理」中填寫的各筆配息紀錄加總計算。
@@ -823,20 +1365,20 @@ TEMPLATE_INDEX = """
         </span>
         <span class="value">
           <span class="{% if f.fill_ratio > 100 %}positive{% elif f.fill_ratio < 0 %}negative{% else %}neutral{% endif %}">
-            {{ ('%.1f' % f.fill_ratio) }}%
+            {{ f.fill_ratio_fmt }}%
           </span><br>
           <span style="font-size:11px;color:#666;">
-            每股息約 {{ '%.3f' % f.div_per_share }} 元
+            每股息約 {{ f.div_per_share_fmt }} 元
           </span>
         </span>
       </div>
       <div class="row" style="font-size:12px;color:#666;">
-        <span>除息前價：約 {{ '%.2f' % f.pre_close }} 元</span>
-        <span>現價：{{ '%.2f' % f.now_price }} 元</span>
+        <span>除息前價：約 {{ f.pre_close_fmt }} 元</span>
+        <span>現價：{{ f.now_price_fmt }} 元</span>
       </div>
       <div class="row" style="font-size:12px;color:#666;margin-bottom:6px;">
         <span>距除息前價還差</span>
-        <span>{{ '%.2f' % f.gap_to_fill }} 元</span>
+        <span>{{ f.gap_to_fill_fmt }} 元</span>
       </div>
       <hr style="border:none;border-top:1px dashed #eee;margin:4px 0;">
       {% endfor %}
@@ -852,15 +1394,15 @@ TEMPLATE_INDEX = """
     <h2>買房頭期款進度</h2>
     <div class="row">
       <span class="label">目前頭期（ETF 市值）</span>
-      <span class="value">{{ fmt_money(house_goal.current_mv) }} 元</span>
+      <span class="value">{{ house_goal.current_mv|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">距離 650 萬</span>
-      <span class="value">{{ fmt_money(house_goal.diff_low) }} 元</span>
+      <span class="value">{{ house_goal.diff_low|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">距離 750 萬</span>
-      <span class="value">{{ fmt_money(house_goal.diff_high) }} 元</span>
+      <span class="value">{{ house_goal.diff_high|money }} 元</span>
     </div>
     <div class="big-number">
       650 萬：約 {{ house_goal.years_low if house_goal.years_low is not none else '-' }} 年後
@@ -876,37 +1418,18 @@ TEMPLATE_INDEX = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：持股管理 =========
 
-TEMPLATE_HOLDINGS = """
+TEMPLATE_HOLDINGS = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>持股管理</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body {font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:540px;margin:0 auto 32px;}
-    h1{font-size:22px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:10px;}
-    .top-link{text-align:center;margin-bottom:10px;font-size:12px;}
-    .top-link a{color:#3949ab;text-decoration:none;}
-    .card{background:#fff;border-radius:16px;padding:14px 16px;margin-bottom:10px;box-shadow:0 4px 12px rgba(0,0,0,0.06);font-size:13px;}
-    .row{display:flex;justify-content:space-between;margin:4px 0;gap:6px;align-items:center;}
-    .label{color:#555;}
-    input[type="text"],input[type="number"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:4px 8px;font-size:13px;}
-    .btn-row{text-align:right;margin-top:8px;}
-    .btn{display:inline-block;padding:4px 10px;border-radius:999px;border:none;font-size:12px;cursor:pointer;text-decoration:none;margin-left:6px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-    .btn-danger{background:#d32f2f;color:#fff;}
-    .tag{display:inline-block;padding:2px 6px;border-radius:999px;background:#eef2ff;font-size:11px;color:#3949ab;margin-left:4px;}
-    form.inline{display:inline;}
-    .note{font-size:11px;color:#777;margin-top:6px;line-height:1.4;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/holdings.css') }}">
 </head>
 <body>
 <div class="container">
@@ -977,31 +1500,18 @@ TEMPLATE_HOLDINGS = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：持股編輯 =========
 
-TEMPLATE_HOLDINGS_EDIT = """
+TEMPLATE_HOLDINGS_EDIT = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>編輯持股 #{{ h.id }}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:480px;margin:0 auto 32px;}
-    h1{font-size:20px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:12px;}
-    .card{background:#fff;border-radius:16px;padding:16px 18px;margin-bottom:14px;box-shadow:0 4px 12px rgba(0,0,0,0.06);}
-    .row{display:flex;justify-content:space-between;margin:6px 0;gap:8px;align-items:center;font-size:14px;}
-    .label{color:#555;flex:0 0 80px;}
-    input[type="text"],input[type="number"]{flex:1;border-radius:999px;border:1px solid #ddd;padding:6px 10px;font-size:14px;}
-    .btn-row{text-align:right;margin-top:10px;}
-    .btn{display:inline-block;padding:6px 14px;border-radius:999px;border:none;font-size:13px;cursor:pointer;text-decoration:none;margin-left:8px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/holdings_edit.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1035,37 +1545,18 @@ TEMPLATE_HOLDINGS_EDIT = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：配息管理 =========
 
-TEMPLATE_DIVIDENDS = """
+TEMPLATE_DIVIDENDS = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>配息管理</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:540px;margin:0 auto 32px;}
-    h1{font-size:22px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:10px;}
-    .top-link{text-align:center;margin-bottom:10px;font-size:12px;}
-    .top-link a{color:#3949ab;text-decoration:none;}
-    .card{background:#fff;border-radius:16px;padding:14px 16px;margin-bottom:10px;box-shadow:0 4px 12px rgba(0,0,0,0.06);font-size:13px;}
-    .row{display:flex;justify-content:space-between;margin:4px 0;gap:6px;align-items:center;}
-    .label{color:#555;}
-    input[type="text"],input[type="number"],input[type="date"]{flex:1;border-radius:999px;border:1px solid #ddd;padding:4px 8px;font-size:13px;}
-    .btn-row{text-align:right;margin-top:8px;}
-    .btn{display:inline-block;padding:4px 10px;border-radius:999px;border:none;font-size:12px;cursor:pointer;text-decoration:none;margin-left:6px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-    .btn-danger{background:#d32f2f;color:#fff;}
-    .tag{display:inline-block;padding:2px 6px;border-radius:999px;background:#eef2ff;font-size:11px;color:#3949ab;margin-left:4px;}
-    form.inline{display:inline;}
-    .note{font-size:11px;color:#777;margin-top:6px;line-height:1.4;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/dividends.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1113,7 +1604,7 @@ TEMPLATE_DIVIDENDS = """
     </div>
     <div class="row">
       <span class="label">現金</span>
-      <span>{{ fmt_money(d.cash) }} 元</span>
+      <span>{{ d.cash|money }} 元</span>
     </div>
     {% if d.note %}
     <div class="row">
@@ -1138,31 +1629,18 @@ TEMPLATE_DIVIDENDS = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：配息編輯 =========
 
-TEMPLATE_DIVIDENDS_EDIT = """
+TEMPLATE_DIVIDENDS_EDIT = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>編輯配息 #{{ d.id }}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:480px;margin:0 auto 32px;}
-    h1{font-size:20px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:12px;}
-    .card{background:#fff;border-radius:16px;padding:16px 18px;margin-bottom:14px;box-shadow:0 4px 12px rgba(0,0,0,0.06);}
-    .row{display:flex;justify-content:space-between;margin:6px 0;gap:8px;align-items:center;font-size:14px;}
-    .label{color:#555;flex:0 0 80px;}
-    input[type="text"],input[type="number"],input[type="date"]{flex:1;border-radius:999px;border:1px solid #ddd;padding:6px 10px;font-size:14px;}
-    .btn-row{text-align:right;margin-top:10px;}
-    .btn{display:inline-block;padding:6px 14px;border-radius:999px;border:none;font-size:13px;cursor:pointer;text-decoration:none;margin-left:8px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/dividends_edit.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1196,37 +1674,18 @@ TEMPLATE_DIVIDENDS_EDIT = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：DCA 管理 =========
 
-TEMPLATE_DCA = """
+TEMPLATE_DCA = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>DCA 管理</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:540px;margin:0 auto 32px;}
-    h1{font-size:22px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:10px;}
-    .top-link{text-align:center;margin-bottom:10px;font-size:12px;}
-    .top-link a{color:#3949ab;text-decoration:none;}
-    .card{background:#fff;border-radius:16px;padding:14px 16px;margin-bottom:10px;box-shadow:0 4px 12px rgba(0,0,0,0.06);font-size:13px;}
-    .row{display:flex;justify-content:space-between;margin:4px 0;gap:6px;align-items:center;}
-    .label{color:#555;}
-    input[type="text"],input[type="number"],input[type="date"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:4px 8px;font-size:13px;}
-    .btn-row{text-align:right;margin-top:8px;}
-    .btn{display:inline-block;padding:4px 10px;border-radius:999px;border:none;font-size:12px;cursor:pointer;text-decoration:none;margin-left:6px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-    .btn-danger{background:#d32f2f;color:#fff;}
-    .tag{display:inline-block;padding:2px 6px;border-radius:999px;background:#eef2ff;font-size:11px;color:#3949ab;margin-left:4px;}
-    form.inline{display:inline;}
-    .note{font-size:11px;color:#777;margin-top:6px;line-height:1.4;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/dca.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1270,7 +1729,7 @@ TEMPLATE_DCA = """
     </div>
     <div class="row">
       <span class="label">金額</span>
-      <span>{{ fmt_money(r.amount) }} 元</span>
+      <span>{{ r.amount|money }} 元</span>
     </div>
     <div class="btn-row">
       <a href="{{ url_for('edit_dca', dca_id=r.id) }}" class="btn btn-secondary">編輯</a>
@@ -1289,31 +1748,18 @@ TEMPLATE_DCA = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：DCA 編輯 =========
 
-TEMPLATE_DCA_EDIT = """
+TEMPLATE_DCA_EDIT = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>編輯 DCA #{{ r.id }}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:480px;margin:0 auto 32px;}
-    h1{font-size:20px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:12px;}
-    .card{background:#fff;border-radius:16px;padding:16px 18px;margin-bottom:14px;box-shadow:0 4px 12px rgba(0,0,0,0.06);}
-    .row{display:flex;justify-content:space-between;margin:6px 0;gap:8px;align-items:center;font-size:14px;}
-    .label{color:#555;flex:0 0 80px;}
-    input[type="text"],input[type="number"],input[type="date"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
-    .btn-row{text-align:right;margin-top:10px;}
-    .btn{display:inline-block;padding:6px 14px;border-radius:999px;border:none;font-size:13px;cursor:pointer;text-decoration:none;margin-left:8px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/dca_edit.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1343,48 +1789,23 @@ TEMPLATE_DCA_EDIT = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：交易管理 =========
 
-TEMPLATE_TRADES = """
+TEMPLATE_TRADES = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>交易紀錄管理</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:540px;margin:0 auto 32px;}
-    h1{font-size:22px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:8px;}
-    .top-link{text-align:center;margin-bottom:10px;font-size:12px;}
-    .top-link a{color:#3949ab;text-decoration:none;}
-    .card{background:#fff;border-radius:16px;padding:14px 16px;margin-bottom:10px;box-shadow:0 4px 12px rgba(0,0,0,0.06);font-size:13px;}
-    .row{display:flex;justify-content:space-between;margin:2px 0;gap:6px;align-items:center;}
-    .label{color:#555;}
-    .tag{display:inline-block;padding:2px 6px;border-radius:999px;background:#eef2ff;font-size:11px;color:#3949ab;margin-left:4px;}
-    .btn-row{margin-top:6px;text-align:right;}
-    .btn{display:inline-block;padding:4px 10px;border-radius:999px;border:none;font-size:12px;cursor:pointer;text-decoration:none;margin-left:6px;}
-    .btn-edit{background:#3949ab;color:#fff;}
-    .btn-delete{background:#d32f2f;color:#fff;}
-    form.inline{display:inline;}
-    .note{font-size:11px;color:#777;margin-top:6px;line-height:1.4;}
-    .filter-card{background:#fff;border-radius:16px;padding:10px 12px;margin-bottom:10px;box-shadow:0 3px 8px rgba(0,0,0,0.04);font-size:12px;}
-    .filter-row{display:flex;gap:8px;margin-bottom:6px;align-items:center;}
-    .filter-row label{font-size:12px;color:#555;flex:0 0 50px;}
-    .filter-row select{flex:1;border-radius:999px;border:1px solid:#ddd;padding:4px 8px;font-size:12px;}
-    .filter-actions{text-align:right;margin-top:4px;}
-    .btn-filter{padding:4px 10px;border-radius:999px;border:none;background:#3949ab;color:#fff;font-size:12px;cursor:pointer;margin-left:6px;}
-    .btn-reset{padding:4px 10px;border-radius:999px;border:none;background:#e0e0e0;color:#333;font-size:12px;cursor:pointer;}
-    .pill{display:inline-block;padding:2px 8px;border-radius:999px;background:#f1f3ff;color:#3949ab;font-size:11px;margin-right:4px;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/trades.css') }}">
 </head>
 <body>
 <div class="container">
   <h1>交易紀錄管理</h1>
-  <div class="subtitle">目前顯示：{{ trades|length }} 筆</div>
+  <div class="subtitle">目前顯示：{{ trade_count }} 筆</div>
   <div class="top-link">
     <a href="{{ url_for('index') }}">◀ 返回儀表板</a>
   </div>
@@ -1434,15 +1855,15 @@ TEMPLATE_TRADES = """
   <div class="card">
     <div class="row">
       <span class="label">累積總投入（全部）</span>
-      <span>{{ fmt_money(trade_totals.total_amount) }} 元</span>
+      <span>{{ trade_totals.total_amount|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">其中配息複投</span>
-      <span>{{ fmt_money(trade_totals.total_reinvest) }} 元</span>
+      <span>{{ trade_totals.total_reinvest|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">自掏腰包</span>
-      <span>{{ fmt_money(trade_totals.total_new_cash) }} 元</span>
+      <span>{{ trade_totals.total_new_cash|money }} 元</span>
     </div>
     <div class="note">
       以上為「所有年份＋所有標的」的累積數字，不受上方篩選影響。
@@ -1453,15 +1874,15 @@ TEMPLATE_TRADES = """
   <div class="card">
     <div class="row">
       <span class="label">篩選後投入小計</span>
-      <span>{{ fmt_money(filtered_totals.total_amount) }} 元</span>
+      <span>{{ filtered_totals.total_amount|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">其中配息複投</span>
-      <span>{{ fmt_money(filtered_totals.total_reinvest) }} 元</span>
+      <span>{{ filtered_totals.total_reinvest|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">自掏腰包</span>
-      <span>{{ fmt_money(filtered_totals.total_new_cash) }} 元</span>
+      <span>{{ filtered_totals.total_new_cash|money }} 元</span>
     </div>
     <div class="note">
       僅計算目前篩選條件下（標的 / 年份）的交易紀錄合計。
@@ -1483,11 +1904,11 @@ TEMPLATE_TRADES = """
     </div>
     <div class="row">
       <span class="label">總投入金額</span>
-      <span>{{ fmt_money(t.amount) }} 元</span>
+      <span>{{ t.amount|money }} 元</span>
     </div>
     <div class="row">
       <span class="label">其中配息複投</span>
-      <span>{{ fmt_money(t.reinvest) }} 元</span>
+      <span>{{ t.reinvest|money }} 元</span>
     </div>
     <div class="btn-row">
       <a class="btn btn-edit" href="{{ url_for('edit_trade', trade_id=t.id) }}">編輯</a>
@@ -1506,32 +1927,18 @@ TEMPLATE_TRADES = """
 </div>
 </body>
 </html>
-"""
+""")
 
 # ======== HTML 模板：交易編輯 =========
 
-TEMPLATE_TRADES_EDIT = """
+TEMPLATE_TRADES_EDIT = squeeze_html("""
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
   <title>編輯交易 #{{ trade.id }}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <style>
-    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-    .container{max-width:480px;margin:0 auto 32px;}
-    h1{font-size:20px;text-align:center;margin-bottom:8px;}
-    .subtitle{text-align:center;font-size:12px;color:#666;margin-bottom:12px;}
-    .card{background:#fff;border-radius:16px;padding:16px 18px;margin-bottom:14px;box-shadow:0 4px 12px rgba(0,0,0,0.06);}
-    .row{display:flex;justify-content:space-between;margin:6px 0;gap:8px;align-items:center;font-size:14px;}
-    .label{color:#555;flex:0 0 90px;}
-    input[type="text"],input[type="number"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
-    .note{font-size:11px;color:#777;margin-top:6px;line-height:1.4;}
-    .btn-row{text-align:right;margin-top:10px;}
-    .btn{display:inline-block;padding:6px 14px;border-radius:999px;border:none;font-size:13px;cursor:pointer;text-decoration:none;margin-left:8px;}
-    .btn-primary{background:#3949ab;color:#fff;}
-    .btn-secondary{background:#e0e0e0;color:#333;}
-  </style>
+  <link rel="stylesheet" href="{{ static_url('css/trades_edit.css') }}">
 </head>
 <body>
 <div class="container">
@@ -1571,14 +1978,210 @@ TEMPLATE_TRADES_EDIT = """
 </div>
 </body>
 </html>
-"""
+""")
+
+# ======== HTML 模板：登入 =========
+
+TEMPLATE_LOGIN = squeeze_html("""
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>登入</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <style>
+    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
+    .container{max-width:420px;margin:40px auto;}
+    h1{text-align:center;font-size:24px;margin-bottom:10px;}
+    .card{background:#fff;border-radius:16px;padding:16px 18px;box-shadow:0 6px 18px rgba(0,0,0,0.06);}
+    .row{display:flex;gap:8px;margin:6px 0;align-items:center;}
+    .label{flex:0 0 60px;color:#555;font-size:14px;}
+    input[type="text"],input[type="password"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
+    .btn-row{text-align:right;margin-top:10px;}
+    button{padding:6px 14px;border-radius:999px;border:none;background:#3949ab;color:#fff;font-size:14px;cursor:pointer;}
+    .link{text-align:center;margin-top:10px;font-size:13px;}
+    .link a{color:#3949ab;text-decoration:none;}
+    .flash{background:#ffeaa7;padding:6px 10px;border-radius:999px;font-size:12px;margin-bottom:8px;text-align:center;}
+  </style>
+</head>
+<body>
+<div class="container">
+  {% with messages = get_flashed_messages() %}
+    {% if messages %}
+      {% for m in messages %}
+        <div class="flash">{{ m }}</div>
+      {% endfor %}
+    {% endif %}
+  {% endwith %}
+  <h1>ETF 儀表板登入</h1>
+  <div class="card">
+    <form method="post">
+      <div class="row">
+        <span class="label">帳號</span>
+        <input type="text" name="username" required>
+      </div>
+      <div class="row">
+        <span class="label">密碼</span>
+        <input type="password" name="password" required>
+      </div>
+      <div class="btn-row">
+        <button type="submit">登入</button>
+      </div>
+    </form>
+    <div class="link">
+      還沒有帳號？ <a href="{{ url_for('register') }}">去註冊</a>
+    </div>
+  </div>
+</div>
+</body>
+</html>
+""")
+
+# ======== HTML 模板：註冊 =========
+
+TEMPLATE_REGISTER = squeeze_html("""
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>註冊</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <style>
+    body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
+    .container{max-width:420px;margin:40px auto;}
+    h1{text-align:center;font-size:24px;margin-bottom:10px;}
+    .card{background:#fff;border-radius:16px;padding:16px 18px;box-shadow:0 6px 18px rgba(0,0,0,0.06);}
+    .row{display:flex;gap:8px;margin:6px 0;align-items:center;}
+    .label{flex:0 0 60px;color:#555;font-size:14px;}
+    input[type="text"],input[type="password"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
+    .btn-row{text-align:right;margin-top:10px;}
+    button{padding:6px 14px;border-radius:999px;border:none;background:#3949ab;color:#fff;font-size:14px;cursor:pointer;}
+    .link{text-align:center;margin-top:10px;font-size:13px;}
+    .link a{color:#3949ab;text-decoration:none;}
+    .flash{background:#ffeaa7;padding:6px 10px;border-radius:999px;font-size:12px;margin-bottom:8px;text-align:center;}
+  </style>
+</head>
+<body>
+<div class="container">
+  {% with messages = get_flashed_messages() %}
+    {% if messages %}
+      {% for m in messages %}
+        <div class="flash">{{ m }}</div>
+      {% endfor %}
+    {% endif %}
+  {% endwith %}
+  <h1>註冊帳號</h1>
+  <div class="card">
+    <form method="post">
+      <div class="row">
+        <span class="label">帳號</span>
+        <input type="text" name="username" required>
+      </div>
+      <div class="row">
+        <span class="label">密碼</span>
+        <input type="password" name="password" required>
+      </div>
+      <div class="btn-row">
+        <button type="submit">建立帳號</button>
+      </div>
+    </form>
+    <div class="link">
+      已有帳號？ <a href="{{ url_for('login') }}">去登入</a>
+    </div>
+  </div>
+</div>
+</body>
+</html>
+""")
 
 # ======== Flask App & Routes =========
 
 app = Flask(__name__)
 app.secret_key = "CHANGE_THIS_TO_RANDOM_STRING"  # 記得改成自己的隨機字串
+# 模板不會在執行中改動，關掉自動重新載入（要在第一次用到 jinja_env 前設定）
+app.config["TEMPLATES_AUTO_RELOAD"] = False
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
+app.teardown_appcontext(close_db)
 init_db()
 
+# {filename: 內容雜湊}
+_static_versions = {}
+
+
+def static_url(filename):
+    """static 檔案的網址，後面加上內容雜湊（?v=...），部署新版 CSS 時瀏覽器會重新下載。"""
+    version = _static_versions.get(filename)
+    if version is None:
+        path = Path(app.static_folder) / filename
+        version = _static_versions[filename] = hashlib.md5(path.read_bytes()).hexdigest()[:8]
+    return url_for("static", filename=filename, v=version)
+
+
+app.jinja_env.globals["static_url"] = static_url
+
+# 格式化函式註冊成模板 filter（{{ x|money }} / {{ x|pct }}），要在編譯模板前註冊
+app.jinja_env.filters.update(money=fmt_money, pct=fmt_pct)
+
+# render_template_string 每次都重新編譯模板；這裡啟動時編譯一次，之後直接重用
+TPL_INDEX = app.jinja_env.from_string(TEMPLATE_INDEX)
+TPL_TRADES = app.jinja_env.from_string(TEMPLATE_TRADES)
+TPL_TRADES_EDIT = app.jinja_env.from_string(TEMPLATE_TRADES_EDIT)
+TPL_HOLDINGS = app.jinja_env.from_string(TEMPLATE_HOLDINGS)
+TPL_HOLDINGS_EDIT = app.jinja_env.from_string(TEMPLATE_HOLDINGS_EDIT)
+TPL_DIVIDENDS = app.jinja_env.from_string(TEMPLATE_DIVIDENDS)
+TPL_DIVIDENDS_EDIT = app.jinja_env.from_string(TEMPLATE_DIVIDENDS_EDIT)
+TPL_DCA = app.jinja_env.from_string(TEMPLATE_DCA)
+TPL_DCA_EDIT = app.jinja_env.from_string(TEMPLATE_DCA_EDIT)
+TPL_LOGIN = app.jinja_env.from_string(TEMPLATE_LOGIN)
+TPL_REGISTER = app.jinja_env.from_string(TEMPLATE_REGISTER)
+
+def _prefetch_in_background():
+    threading.Thread(target=prefetch_prices, daemon=True).start()
+
+
+# fork 前先關掉池子裡的連線，worker 不會繼承到開著的 SQLite 連線
+os.register_at_fork(before=close_pool)
+
+# 設了 PRELOAD_PRICES：gunicorn --preload 的 master 不碰 yfinance（它共用的 HTTP session 和
+# Ticker 物件不能跨 fork 給多個 worker 用），每個 worker fork 出來後才在背景先抓一輪價格
+if os.environ.get("PRELOAD_PRICES"):
+    os.register_at_fork(after_in_child=_prefetch_in_background)
+
+# 設了 PRICE_REFRESH 就在背景定期更新價格
+if os.environ.get("PRICE_REFRESH"):
+    app.before_request(start_price_refresher)
+
+
+# ======== 回應壓縮 =========
+
+@app.after_request
+def gzip_response(response):
+    """HTML 頁面大多是重複的 CSS，瀏覽器支援 gzip 就壓縮後再送。"""
+    if (
+        response.mimetype != "text/html"
+        or response.direct_passthrough
+        or response.is_streamed  # 串流輸出（/trades）不整包壓縮，不然就失去串流的意義
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        "gzip" not in request.headers.get("Accept-Encoding", "")
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    # 壓縮後內容已不是原本的 bytes，強 ETag 要降成弱 ETag（If-None-Match 仍可比對）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 # ======== 登入 / 註冊 / 登出 =========
 
 @app.route("/login", methods=["GET", "POST"])
@@ -1594,7 +2197,7 @@ def login():
         conn = get_db()
         cur = conn.execute("SELECT * FROM users WHERE username = ?", (username,))
         user = cur.fetchone()
-        conn.close()
+        release_db(conn)
 
         if user and check_password_hash(user["password_hash"], password):
             session["user_id"] = user["id"]
@@ -1605,61 +2208,7 @@ def login():
             flash("帳號或密碼錯誤")
             return redirect(url_for("login"))
 
-    login_html = """
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <title>登入</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1">
-      <style>
-        body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-        .container{max-width:420px;margin:40px auto;}
-        h1{text-align:center;font-size:24px;margin-bottom:10px;}
-        .card{background:#fff;border-radius:16px;padding:16px 18px;box-shadow:0 6px 18px rgba(0,0,0,0.06);}
-        .row{display:flex;gap:8px;margin:6px 0;align-items:center;}
-        .label{flex:0 0 60px;color:#555;font-size:14px;}
-        input[type="text"],input[type="password"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
-        .btn-row{text-align:right;margin-top:10px;}
-        button{padding:6px 14px;border-radius:999px;border:none;background:#3949ab;color:#fff;font-size:14px;cursor:pointer;}
-        .link{text-align:center;margin-top:10px;font-size:13px;}
-        .link a{color:#3949ab;text-decoration:none;}
-        .flash{background:#ffeaa7;padding:6px 10px;border-radius:999px;font-size:12px;margin-bottom:8px;text-align:center;}
-      </style>
-    </head>
-    <body>
-    <div class="container">
-      {% with messages = get_flashed_messages() %}
-        {% if messages %}
-          {% for m in messages %}
-            <div class="flash">{{ m }}</div>
-          {% endfor %}
-        {% endif %}
-      {% endwith %}
-      <h1>ETF 儀表板登入</h1>
-      <div class="card">
-        <form method="post">
-          <div class="row">
-            <span class="label">帳號</span>
-            <input type="text" name="username" required>
-          </div>
-          <div class="row">
-            <span class="label">密碼</span>
-            <input type="password" name="password" required>
-          </div>
-          <div class="btn-row">
-            <button type="submit">登入</button>
-          </div>
-        </form>
-        <div class="link">
-          還沒有帳號？ <a href="{{ url_for('register') }}">去註冊</a>
-        </div>
-      </div>
-    </div>
-    </body>
-    </html>
-    """
-    return render_template_string(login_html)
+    return render_template(TPL_LOGIN)
 
 
 @app.route("/register", methods=["GET", "POST"])
@@ -1685,63 +2234,9 @@ def register():
             flash("此帳號已被使用")
             return redirect(url_for("register"))
         finally:
-            conn.close()
-
-    register_html = """
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <title>註冊</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1">
-      <style>
-        body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;background:#f5f5f7;margin:0;padding:16px;}
-        .container{max-width:420px;margin:40px auto;}
-        h1{text-align:center;font-size:24px;margin-bottom:10px;}
-        .card{background:#fff;border-radius:16px;padding:16px 18px;box-shadow:0 6px 18px rgba(0,0,0,0.06);}
-        .row{display:flex;gap:8px;margin:6px 0;align-items:center;}
-        .label{flex:0 0 60px;color:#555;font-size:14px;}
-        input[type="text"],input[type="password"]{flex:1;border-radius:999px;border:1px solid:#ddd;padding:6px 10px;font-size:14px;}
-        .btn-row{text-align:right;margin-top:10px;}
-        button{padding:6px 14px;border-radius:999px;border:none;background:#3949ab;color:#fff;font-size:14px;cursor:pointer;}
-        .link{text-align:center;margin-top:10px;font-size:13px;}
-        .link a{color:#3949ab;text-decoration:none;}
-        .flash{background:#ffeaa7;padding:6px 10px;border-radius:999px;font-size:12px;margin-bottom:8px;text-align:center;}
-      </style>
-    </head>
-    <body>
-    <div class="container">
-      {% with messages = get_flashed_messages() %}
-        {% if messages %}
-          {% for m in messages %}
-            <div class="flash">{{ m }}</div>
-          {% endfor %}
-        {% endif %}
-      {% endwith %}
-      <h1>註冊帳號</h1>
-      <div class="card">
-        <form method="post">
-          <div class="row">
-            <span class="label">帳號</span>
-            <input type="text" name="username" required>
-          </div>
-          <div class="row">
-            <span class="label">密碼</span>
-            <input type="password" name="password" required>
-          </div>
-          <div class="btn-row">
-            <button type="submit">建立帳號</button>
-          </div>
-        </form>
-        <div class="link">
-          已有帳號？ <a href="{{ url_for('login') }}">去登入</a>
-        </div>
-      </div>
-    </div>
-    </body>
-    </html>
-    """
-    return render_template_string(register_html)
+            release_db(conn)
+
+    return render_template(TPL_REGISTER)
 
 
 @app.route("/logout")
@@ -1766,26 +2261,15 @@ def index():
         amount_raw = request.form.get("amount", "").strip()
         reinvest_raw = request.form.get("reinvest", "").strip()
 
-        try:
-            shares = int(shares_raw) if shares_raw else 0
-        except ValueError:
-            shares = 0
-
-        try:
-            amount = float(amount_raw) if amount_raw else 0.0
-        except ValueError:
-            amount = 0.0
-
-        try:
-            reinvest = float(reinvest_raw) if reinvest_raw else 0.0
-        except ValueError:
-            reinvest = 0.0
+        shares = parse_int(shares_raw)
+        amount = parse_float(amount_raw)
+        reinvest = parse_float(reinvest_raw)
 
         if symbol and shares > 0 and amount > 0:
             if date_str:
                 ts_value = f"{date_str} 00:00:00"
             else:
-                ts_value = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                ts_value = now_ts()
 
             conn = get_db()
             conn.execute(
@@ -1795,31 +2279,51 @@ def index():
                 """,
                 (user_id, ts_value, symbol, shares, amount, reinvest),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
-
-    _, total_amount, total_reinvest, total_new_cash = get_trades_summary(user_id)
-    data = compute_dashboard(user_id)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    today_date = datetime.now().strftime("%Y-%m-%d")
-
-    trade_totals = {
-        "total_amount": total_amount,
-        "total_reinvest": total_reinvest,
-        "total_new_cash": total_new_cash,
-    }
-
-    return render_template_string(
-        TEMPLATE_INDEX,
+            release_db(conn)
+            invalidate_dashboard(user_id)
+
+        # POST 完導回 GET：重新整理不會重送表單，首頁也一律走上面的 HTML 快取
+        return redirect(url_for("index"))
+
+    version = get_data_version(user_id)
+    data = get_dashboard(user_id, version)
+    now_dt = datetime.now()
+    now = now_dt.strftime("%Y-%m-%d %H:%M")
+    today_date = now_dt.strftime("%Y-%m-%d")
+
+    # 同一分鐘內、儀表板資料沒重算，就直接回傳上一次產生的 HTML。
+    # 有待顯示的 flash 訊息時不用快取（訊息只能顯示一次，也不能被存進快取）
+    has_flashes = "_flashes" in session
+    cached = _index_html_cache.get(user_id)
+    if cached and not has_flashes and cached[0] is data and cached[1] == now:
+        return _html_response(cached[2], cached[3])
+
+    html = render_template(
+        TPL_INDEX,
         now=now,
         today_date=today_date,
-        fmt_money=fmt_money,
-        fmt_pct=fmt_pct,
         ANNUAL_RETURN=ANNUAL_RETURN,
         MONTHLY_DCA=MONTHLY_DCA,
-        trade_totals=trade_totals,
-        **data,   # etfs / totals / div_compare / dca_compare / house_goal / fill_infos
+        **data,   # etfs / totals / div_compare / dca_compare / house_goal / fill_infos / trade_totals
     )
+    if has_flashes:
+        return html
+
+    # 存成 UTF-8 bytes：之後命中快取時 Flask 直接送出，不必每次再 encode 一次
+    body = html.encode("utf-8")
+    # ETag 帶上資料版本號：別的 worker 寫入後版本號就變，瀏覽器不會再拿到 304
+    etag = f"{version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"
+    _index_html_cache[user_id] = (data, now, body, etag)
+    return _html_response(body, etag)
+
+
+def _html_response(body, etag):
+    """帶 ETag 回傳；瀏覽器的 If-None-Match 對得上就只回 304，不送內容。"""
+    resp = Response(body, mimetype="text/html")
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
 
 
 # ======== 持股管理 =========
@@ -1835,15 +2339,8 @@ def holdings_page():
         shares_raw = request.form.get("shares", "").strip()
         cost_raw = request.form.get("cost", "").strip()
 
-        try:
-            shares = int(shares_raw) if shares_raw else 0
-        except ValueError:
-            shares = 0
-
-        try:
-            cost = float(cost_raw) if cost_raw else 0.0
-        except ValueError:
-            cost = 0.0
+        shares = parse_int(shares_raw)
+        cost = parse_float(cost_raw)
 
         if symbol and name and shares > 0 and cost > 0:
             conn = get_db()
@@ -1854,12 +2351,14 @@ def holdings_page():
                 """,
                 (user_id, symbol, name, shares, cost),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
 
     holdings = get_all_holdings(user_id)
-    return render_template_string(
-        TEMPLATE_HOLDINGS,
+    return render_template(
+        TPL_HOLDINGS,
         holdings=holdings,
     )
 
@@ -1876,7 +2375,7 @@ def edit_holding(holding_id):
     row = cur.fetchone()
 
     if not row:
-        conn.close()
+        release_db(conn)
         return "Holding not found", 404
 
     if request.method == "POST":
@@ -1885,15 +2384,8 @@ def edit_holding(holding_id):
         shares_raw = request.form.get("shares", "").strip()
         cost_raw = request.form.get("cost", "").strip()
 
-        try:
-            shares = int(shares_raw) if shares_raw else 0
-        except ValueError:
-            shares = 0
-
-        try:
-            cost = float(cost_raw) if cost_raw else 0.0
-        except ValueError:
-            cost = 0.0
+        shares = parse_int(shares_raw)
+        cost = parse_float(cost_raw)
 
         if symbol and name and shares > 0 and cost > 0:
             conn.execute(
@@ -1904,13 +2396,15 @@ def edit_holding(holding_id):
                 """,
                 (symbol, name, shares, cost, holding_id, user_id),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
             return redirect(url_for("holdings_page"))
 
-    conn.close()
-    return render_template_string(
-        TEMPLATE_HOLDINGS_EDIT,
+    release_db(conn)
+    return render_template(
+        TPL_HOLDINGS_EDIT,
         h=row,
     )
 
@@ -1924,8 +2418,10 @@ def delete_holding(holding_id):
         "DELETE FROM holdings WHERE id = ? AND user_id = ?",
         (holding_id, user_id),
     )
+    bump_data_version(conn, user_id)
     conn.commit()
-    conn.close()
+    invalidate_dashboard(user_id)
+    release_db(conn)
     return redirect(url_for("holdings_page"))
 
 
@@ -1942,10 +2438,7 @@ def dividends_page():
         cash_raw = request.form.get("cash", "").strip()
         note = request.form.get("note", "").strip()
 
-        try:
-            cash = float(cash_raw) if cash_raw else 0.0
-        except ValueError:
-            cash = 0.0
+        cash = parse_float(cash_raw)
 
         if date_str and symbol and cash > 0:
             conn = get_db()
@@ -1956,14 +2449,15 @@ def dividends_page():
                 """,
                 (user_id, date_str, symbol, cash, note if note else None),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
 
     dividends = get_all_dividends(user_id)
-    return render_template_string(
-        TEMPLATE_DIVIDENDS,
+    return stream_template(
+        TPL_DIVIDENDS,
         dividends=dividends,
-        fmt_money=fmt_money,
     )
 
 
@@ -1979,7 +2473,7 @@ def edit_dividend(div_id):
     row = cur.fetchone()
 
     if not row:
-        conn.close()
+        release_db(conn)
         return "Dividend not found", 404
 
     if request.method == "POST":
@@ -1988,10 +2482,7 @@ def edit_dividend(div_id):
         cash_raw = request.form.get("cash", "").strip()
         note = request.form.get("note", "").strip()
 
-        try:
-            cash = float(cash_raw) if cash_raw else 0.0
-        except ValueError:
-            cash = 0.0
+        cash = parse_float(cash_raw)
 
         if date_str and symbol and cash > 0:
             conn.execute(
@@ -2002,13 +2493,15 @@ def edit_dividend(div_id):
                 """,
                 (date_str, symbol, cash, note if note else None, div_id, user_id),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
             return redirect(url_for("dividends_page"))
 
-    conn.close()
-    return render_template_string(
-        TEMPLATE_DIVIDENDS_EDIT,
+    release_db(conn)
+    return render_template(
+        TPL_DIVIDENDS_EDIT,
         d=row,
     )
 
@@ -2022,8 +2515,10 @@ def delete_dividend(div_id):
         "DELETE FROM dividends WHERE id = ? AND user_id = ?",
         (div_id, user_id),
     )
+    bump_data_version(conn, user_id)
     conn.commit()
-    conn.close()
+    invalidate_dashboard(user_id)
+    release_db(conn)
     return redirect(url_for("dividends_page"))
 
 
@@ -2039,10 +2534,7 @@ def dca_page():
         symbol = request.form.get("symbol", "").strip()
         amount_raw = request.form.get("amount", "").strip()
 
-        try:
-            amount = float(amount_raw) if amount_raw else 0.0
-        except ValueError:
-            amount = 0.0
+        amount = parse_float(amount_raw)
 
         if date_str and symbol and amount > 0:
             conn = get_db()
@@ -2053,14 +2545,15 @@ def dca_page():
                 """,
                 (user_id, date_str, symbol, amount),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
 
     records = get_all_dca(user_id)
-    return render_template_string(
-        TEMPLATE_DCA,
+    return stream_template(
+        TPL_DCA,
         records=records,
-        fmt_money=fmt_money,
     )
 
 
@@ -2076,7 +2569,7 @@ def edit_dca(dca_id):
     row = cur.fetchone()
 
     if not row:
-        conn.close()
+        release_db(conn)
         return "DCA record not found", 404
 
     if request.method == "POST":
@@ -2084,10 +2577,7 @@ def edit_dca(dca_id):
         symbol = request.form.get("symbol", "").strip()
         amount_raw = request.form.get("amount", "").strip()
 
-        try:
-            amount = float(amount_raw) if amount_raw else 0.0
-        except ValueError:
-            amount = 0.0
+        amount = parse_float(amount_raw)
 
         if date_str and symbol and amount > 0:
             conn.execute(
@@ -2098,13 +2588,15 @@ def edit_dca(dca_id):
                 """,
                 (date_str, symbol, amount, dca_id, user_id),
             )
+            bump_data_version(conn, user_id)
             conn.commit()
-            conn.close()
+            invalidate_dashboard(user_id)
+            release_db(conn)
             return redirect(url_for("dca_page"))
 
-    conn.close()
-    return render_template_string(
-        TEMPLATE_DCA_EDIT,
+    release_db(conn)
+    return render_template(
+        TPL_DCA_EDIT,
         r=row,
     )
 
@@ -2118,81 +2610,107 @@ def delete_dca(dca_id):
         "DELETE FROM dca WHERE id = ? AND user_id = ?",
         (dca_id, user_id),
     )
+    bump_data_version(conn, user_id)
     conn.commit()
-    conn.close()
+    invalidate_dashboard(user_id)
+    release_db(conn)
     return redirect(url_for("dca_page"))
 
 
 # ======== 交易管理 =========
 
+def _build_trades_sql(has_symbol, year_kind):
+    """依篩選組合組出 (小計 SQL, 列表 SQL)；列表的 WHERE 和篩選後小計共用同一段條件。"""
+    conds = []
+    if has_symbol:
+        conds.append("symbol = ?")
+    if year_kind == "range":
+        # 用 ts 範圍比對（'2025' <= ts < '2026'），才能走索引
+        conds.append("ts >= ? AND ts < ?")
+    elif year_kind == "substr":
+        conds.append("substr(ts,1,4) = ?")
+    cond = " AND ".join(conds) or "1"
+
+    # 每筆先算有沒有符合篩選（hit），再分別加總
+    agg_sql = f"""
+        SELECT
+          COALESCE(SUM(amount),0)   AS total_amount,
+          COALESCE(SUM(reinvest),0) AS total_reinvest,
+          COALESCE(SUM(hit),0)      AS n,
+          COALESCE(SUM(CASE WHEN hit THEN amount END),0)   AS filtered_amount,
+          COALESCE(SUM(CASE WHEN hit THEN reinvest END),0) AS filtered_reinvest
+        FROM (SELECT amount, reinvest, ({cond}) AS hit FROM trades WHERE user_id = ?)
+        """
+    list_sql = (
+        f"SELECT * FROM trades WHERE user_id = ? AND {cond} ORDER BY ts DESC, id DESC"
+    )
+    return agg_sql, list_sql
+
+
+# 篩選組合只有幾種，import 時就先組好；每次請求送進 SQLite 的都是同一段字串
+_TRADES_SQL = {
+    (has_symbol, year_kind): _build_trades_sql(has_symbol, year_kind)
+    for has_symbol in (False, True)
+    for year_kind in (None, "range", "substr")
+}
+
+
 @app.route("/trades")
 @login_required
 def trades_page():
     user_id = session["user_id"]
+    symbols, years = get_trade_filters(user_id)
     conn = get_db()
 
-    cur = conn.execute(
-        "SELECT DISTINCT symbol FROM trades WHERE user_id = ? ORDER BY symbol",
-        (user_id,),
-    )
-    symbols_rows = cur.fetchall()
-    symbols = [r["symbol"] for r in symbols_rows]
-
-    cur = conn.execute(
-        "SELECT DISTINCT substr(ts,1,4) AS y FROM trades WHERE user_id = ? ORDER BY y DESC",
-        (user_id,),
-    )
-    years_rows = cur.fetchall()
-    years = [r["y"] for r in years_rows if r["y"]]
-
     selected_symbol = request.args.get("symbol", "").strip()
     selected_year = request.args.get("year", "").strip()
 
-    sql = "SELECT * FROM trades WHERE user_id = ?"
-    params = [user_id]
+    # 篩選條件：選了哪些篩選就決定用哪一組預先組好的 SQL
+    cond_params = []
 
     if selected_symbol:
-        sql += " AND symbol = ?"
-        params.append(selected_symbol)
+        cond_params.append(selected_symbol)
+
+    if _YEAR_RE.fullmatch(selected_year):
+        year_kind = "range"
+        cond_params += [selected_year, str(int(selected_year) + 1)]
+    elif selected_year:
+        year_kind = "substr"
+        cond_params.append(selected_year)
+    else:
+        year_kind = None
 
-    if selected_year:
-        sql += " AND substr(ts,1,4) = ?"
-        params.append(selected_year)
+    agg_sql, list_sql = _TRADES_SQL[(bool(selected_symbol), year_kind)]
 
-    sql += " ORDER BY ts DESC, id DESC"
-    cur = conn.execute(sql, params)
-    rows = cur.fetchall()
+    # 全部累積和篩選後小計一次掃完
+    agg = conn.execute(agg_sql, cond_params + [user_id]).fetchone()
 
-    # 全部累積
-    _, total_amount, total_reinvest, total_new_cash = get_trades_summary(user_id)
     trade_totals = {
-        "total_amount": total_amount,
-        "total_reinvest": total_reinvest,
-        "total_new_cash": total_new_cash,
+        "total_amount": agg["total_amount"],
+        "total_reinvest": agg["total_reinvest"],
+        "total_new_cash": max(0.0, agg["total_amount"] - agg["total_reinvest"]),
     }
-
-    # 篩選後小計
-    filtered_amount = sum(r["amount"] for r in rows) if rows else 0.0
-    filtered_reinvest = sum(r["reinvest"] for r in rows) if rows else 0.0
-    filtered_new_cash = max(0.0, filtered_amount - filtered_reinvest)
     filtered_totals = {
-        "total_amount": filtered_amount,
-        "total_reinvest": filtered_reinvest,
-        "total_new_cash": filtered_new_cash,
+        "total_amount": agg["filtered_amount"],
+        "total_reinvest": agg["filtered_reinvest"],
+        "total_new_cash": max(0.0, agg["filtered_amount"] - agg["filtered_reinvest"]),
     }
 
-    conn.close()
+    release_db(conn)
 
-    return render_template_string(
-        TEMPLATE_TRADES,
+    # 交易列表不先 fetchall：邊讀邊輸出 HTML，筆數再多記憶體也不會跟著長
+    rows = iter_rows(list_sql, [user_id] + cond_params)
+
+    return stream_template(
+        TPL_TRADES,
         trades=rows,
+        trade_count=agg["n"],
         trade_totals=trade_totals,
         filtered_totals=filtered_totals,
         symbols=symbols,
         years=years,
         selected_symbol=selected_symbol,
         selected_year=selected_year,
-        fmt_money=fmt_money,
     )
 
 
@@ -2201,15 +2719,6 @@ def trades_page():
 def edit_trade(trade_id):
     user_id = session["user_id"]
     conn = get_db()
-    cur = conn.execute(
-        "SELECT * FROM trades WHERE id = ? AND user_id = ?",
-        (trade_id, user_id),
-    )
-    row = cur.fetchone()
-
-    if not row:
-        conn.close()
-        return "Trade not found", 404
 
     if request.method == "POST":
         ts = request.form.get("ts", "").strip()
@@ -2217,25 +2726,15 @@ def edit_trade(trade_id):
         amount_raw = request.form.get("amount", "").strip()
         reinvest_raw = request.form.get("reinvest", "").strip()
 
-        try:
-            shares = int(shares_raw) if shares_raw else 0
-        except ValueError:
-            shares = 0
-
-        try:
-            amount = float(amount_raw) if amount_raw else 0.0
-        except ValueError:
-            amount = 0.0
-
-        try:
-            reinvest = float(reinvest_raw) if reinvest_raw else 0.0
-        except ValueError:
-            reinvest = 0.0
+        shares = parse_int(shares_raw)
+        amount = parse_float(amount_raw)
+        reinvest = parse_float(reinvest_raw)
 
         if not ts:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ts = now_ts()
 
-        conn.execute(
+        # 不先 SELECT 確認存在：直接 UPDATE，沒有更新到任何一筆就是找不到
+        cur = conn.execute(
             """
             UPDATE trades
             SET ts = ?, shares = ?, amount = ?, reinvest = ?
@@ -2243,13 +2742,29 @@ def edit_trade(trade_id):
             """,
             (ts, shares, amount, reinvest, trade_id, user_id),
         )
+        if cur.rowcount == 0:
+            conn.rollback()
+            release_db(conn)
+            return "Trade not found", 404
+
+        bump_data_version(conn, user_id)
         conn.commit()
-        conn.close()
+        release_db(conn)
+        invalidate_dashboard(user_id)
         return redirect(url_for("trades_page"))
 
-    conn.close()
-    return render_template_string(
-        TEMPLATE_TRADES_EDIT,
+    cur = conn.execute(
+        "SELECT * FROM trades WHERE id = ? AND user_id = ?",
+        (trade_id, user_id),
+    )
+    row = cur.fetchone()
+    release_db(conn)
+
+    if not row:
+        return "Trade not found", 404
+
+    return render_template(
+        TPL_TRADES_EDIT,
         trade=row,
     )
 
@@ -2263,10 +2778,18 @@ def delete_trade(trade_id):
         "DELETE FROM trades WHERE id = ? AND user_id = ?",
         (trade_id, user_id),
     )
+    bump_data_version(conn, user_id)
     conn.commit()
-    conn.close()
+    release_db(conn)
+    invalidate_dashboard(user_id)
     return redirect(url_for("trades_page"))
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # 本機測試用；正式環境請用 gunicorn（見 README）
+    app.run(
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 5000)),
+        debug=False,
+        threaded=True,
+    )